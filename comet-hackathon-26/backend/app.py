@@ -1,27 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 import os
 import re
 import random
 import time
-import fitz  # pymupdf
-from docx import Document
+import threading
+import hashlib
+import tempfile
+from collections import OrderedDict
 import openai
 from werkzeug.utils import secure_filename
 from openai import OpenAI
-import nltk
-from nltk.tokenize import word_tokenize
 from dotenv import load_dotenv
+from utils.inverted_index import InvertedIndex
+from utils.chunker import Chunker
+from utils.text_cleaner import question_keywords
+from utils.knowledge_store import KnowledgeStore
+from utils.extractor import iter_pages, page_count
+from utils.jobs import IngestQueue, QueueFull
+from utils.query_cache import QueryCache
+from utils.metrics import Metrics, SlowRequestProfiler
+from utils.segments import SegmentCatalog
 
 # 1. LOAD ENVIRONMENT VARIABLES
 load_dotenv()
 
-# Setup NLP tools
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
 app = Flask(__name__)
 CORS(app)
 
@@ -35,64 +38,313 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 client = OpenAI()
 UPLOAD_BASE = 'uploads'
 os.makedirs(UPLOAD_BASE, exist_ok=True)
+KNOWLEDGE_DB = os.getenv("KNOWLEDGE_DB", "knowledge.db")
 
-USER_KNOWLEDGE = {}
+# USER_KNOWLEDGE is an LRU of the subjects in use, keyed by (user, subject);
+# STORE is the source of truth, so an evicted subject just reloads from it
+STORE = KnowledgeStore(KNOWLEDGE_DB, cache_bytes=int(os.getenv("EXTRACTION_CACHE_MB", 512)) * 1024 * 1024)
+# Registers this process as alive before it creates any documents or jobs
+STORE.heartbeat()
+USER_KNOWLEDGE = OrderedDict()
+MAX_LOADED_SUBJECTS = int(os.getenv("MAX_LOADED_SUBJECTS", 64))
+KNOWLEDGE_LOCK = threading.Lock()
+SUBJECT_LOCKS = {}
+# Set SEGMENT_DIR (gunicorn.conf.py does) to serve /ask from memory-mapped
+# segments shared by every worker process instead of per-process indexes
+SEGMENTS = SegmentCatalog(os.getenv("SEGMENT_DIR")) if os.getenv("SEGMENT_DIR") else None
+SEGMENT_JOBS = set()
+QUERY_CACHE = QueryCache(maxsize=int(os.getenv("QUERY_CACHE_SIZE", 4096)))
+METRICS = Metrics()
+# Set PROFILE_SLOW_MS to keep cProfile dumps of requests slower than that
+PROFILER = SlowRequestProfiler(float(os.getenv("PROFILE_SLOW_MS")), os.getenv("PROFILE_DIR", "profiles")) if os.getenv("PROFILE_SLOW_MS") else None
 USERS = {"roshni": "roshni123", "sujal": "sujal123", "ronak": "ronak123"}
 
 # -----------------------------------------
 # HELPERS
 # -----------------------------------------
 
-def extract_text(file_path, filename):
-    ext = filename.split('.')[-1].lower()
-    text = ""
-    
-    if ext == 'pdf':
-        with fitz.open(file_path) as doc:
-            for page in doc:
-                text += page.get_text()
-    elif ext == 'docx':
-        doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-    elif ext == 'txt':
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-    return text
+def save_upload(file, path):
+    # Hash the upload while it streams to a temp file next to its final location
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=path, suffix=".part", delete=False) as out:
+        for block in iter(lambda: file.stream.read(1024 * 1024), b""):
+            digest.update(block)
+            out.write(block)
+    return out.name, digest.hexdigest()
+
+def parse_flag(value):
+    # JSON booleans or their string/number spellings; None for anything else
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes", "on"):
+        return True
+    if text in ("false", "0", "no", "off"):
+        return False
+    return None
+
+def subject_lock(user, subject):
+    # Held while one subject loads from the store or takes new chunks, so a load
+    # sees every stored row exactly once without holding up other subjects
+    with KNOWLEDGE_LOCK:
+        return SUBJECT_LOCKS.setdefault((user, subject), threading.Lock())
+
+def get_index(user, subject):
+    # Lazily rebuild the index from the stored tokens on first access
+    key = (user, subject)
+    with KNOWLEDGE_LOCK:
+        index = USER_KNOWLEDGE.get(key)
+        if index is not None:
+            USER_KNOWLEDGE.move_to_end(key)
+            return index
+    # Built outside KNOWLEDGE_LOCK, so loaded subjects keep answering meanwhile
+    with subject_lock(user, subject):
+        with KNOWLEDGE_LOCK:
+            index = USER_KNOWLEDGE.get(key)
+        if index is None:
+            index = InvertedIndex()
+            for text, ref, tokens in STORE.load_chunks(user, subject):
+                index.add(text, ref, tokens)
+            with KNOWLEDGE_LOCK:
+                USER_KNOWLEDGE[key] = index
+                while len(USER_KNOWLEDGE) > MAX_LOADED_SUBJECTS:
+                    USER_KNOWLEDGE.popitem(last=False)
+        return index
+
+def add_chunks(user, subj, document_id, fname, chunks):
+    # chunks are (locator, text, tokens); the citation is the file name plus locator
+    rows = [(text, f"{fname}, {locator}", tokens) for locator, text, tokens in chunks]
+    # Stored under the subject's lock so a concurrent get_index load sees these rows
+    # exactly once; a subject that isn't loaded (or was evicted) picks them up when it next loads
+    with subject_lock(user, subj):
+        STORE.add_chunks(document_id, user, subj, rows)
+        with KNOWLEDGE_LOCK:
+            index = USER_KNOWLEDGE.get((user, subj))
+        if index is not None:
+            for text, ref, tokens in rows:
+                index.add(text, ref, tokens)
+    QUERY_CACHE.invalidate(user, subj)
+
+def in_background(name, target, user, subj):
+    # At most one such job per subject in this process; the segment catalog
+    # itself keeps jobs in different worker processes from colliding
+    key = (name, user, subj)
+    with KNOWLEDGE_LOCK:
+        if key in SEGMENT_JOBS:
+            return
+        SEGMENT_JOBS.add(key)
+
+    def run():
+        try:
+            with METRICS.time("segments", name):
+                target(user, subj)
+        finally:
+            with KNOWLEDGE_LOCK:
+                SEGMENT_JOBS.discard(key)
+
+    threading.Thread(target=run, name=f"segments-{name}", daemon=True).start()
+
+def rebuild_segments(user, subj):
+    SEGMENTS.rebuild(user, subj, lambda: [
+        (document_id, STORE.document_chunks(document_id))
+        for document_id in STORE.complete_documents(user, subj)
+    ])
+
+def publish_document(user, subj, document_id):
+    # Segment mode: the finished document becomes its own small segment, so
+    # publishing costs the document's size; rebuilds and merges of the whole
+    # subject run in the background
+    if not SEGMENTS:
+        return
+    if SEGMENTS.append(user, subj, document_id, STORE.document_chunks(document_id)) is None:
+        in_background("rebuild", rebuild_segments, user, subj)
+    elif SEGMENTS.needs_merge(user, subj):
+        in_background("merge", SEGMENTS.merge, user, subj)
+
+def add_cached_document(user, subj, fname, document_id, cached):
+    # Known file: reuse the cached chunks instead of extracting it again
+    add_chunks(user, subj, document_id, fname, cached)
+    STORE.finish_document(document_id)
+    publish_document(user, subj, document_id)
+    return {"message": f"Learned from {fname}", "chunks": len(cached), "cached": True}
+
+def ingest_file(user, subj, fpath, fname, document_id, content_hash, progress):
+    # fpath is this upload's own temp file; it becomes the visible <fname> only once
+    # ingested, so a later upload under the same name can't swap the content out
+    chunker = Chunker()
+    pages = chunk_count = 0
+    caching = False
+
+    try:
+        total = page_count(fpath, fname)
+        progress(0, total)
+        # Another upload of the same file may already be filling the cache; then just skip it
+        caching = STORE.claim_cache(content_hash)
+
+        # Chunk and index each page as it arrives instead of holding the whole document
+        stream = iter_pages(fpath, fname)
+        while True:
+            with METRICS.time("ingest", "extract"):
+                page = next(stream, None)
+            if page is None:
+                break
+            with METRICS.time("ingest", "chunk"):
+                chunks = chunker.chunk_page(page)
+            with METRICS.time("ingest", "index"):
+                if caching:
+                    STORE.cache_chunks(content_hash, chunk_count, chunks)
+                add_chunks(user, subj, document_id, fname, chunks)
+            pages += 1
+            chunk_count += len(chunks)
+            progress(pages, total)
+    except Exception:
+        # Drop the partial document and let the subject reload from the store
+        if caching:
+            STORE.finish_cache(content_hash, ok=False)
+        STORE.remove_document(document_id)
+        with KNOWLEDGE_LOCK:
+            USER_KNOWLEDGE.pop((user, subj), None)
+        QUERY_CACHE.invalidate(user, subj)
+        os.remove(fpath)
+        raise
+
+    if caching:
+        STORE.finish_cache(content_hash)
+    STORE.finish_document(document_id)
+    with METRICS.time("ingest", "publish"):
+        publish_document(user, subj, document_id)
+    os.replace(fpath, os.path.join(os.path.dirname(fpath), fname))
+    progress(pages, pages)
+    return {"message": f"Learned from {fname}", "pages": pages, "chunks": chunk_count}
+
+# Extraction and indexing run here, off the request thread
+INGEST_QUEUE = IngestQueue(
+    ingest_file,
+    workers=int(os.getenv("INGEST_WORKERS", 2)),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", 50)),
+    max_per_user=int(os.getenv("INGEST_MAX_PER_USER", 5)),
+    store=STORE,
+)
+
+HEARTBEAT_SECONDS = 10
+
+def heartbeat():
+    # Other processes expire this one's jobs and partial documents once the heartbeat stops
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        try:
+            STORE.heartbeat()
+        except Exception:
+            app.logger.exception("Heartbeat failed")
+
+threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
 
 # -----------------------------------------
-# KEYWORD MATCHING LOGIC (STRICT)
+# KEYWORD MATCHING LOGIC (BM25 + STRICT)
 # -----------------------------------------
-def find_best_match(question, chunks):
+RETRIEVAL_MODES = {"strict", "tfidf"}
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", 20))
+
+def find_best_match(question, user, subject, top_k=3, strict=True, mode="strict"):
     # 1. Clean the question into significant keywords
-    stop_words = set(stopwords.words('english'))
-    words = word_tokenize(question.lower())
-    # Only keep words that aren't "the, is, at" and are longer than 2 letters
-    keywords = [w for w in words if w.isalnum() and w not in stop_words and len(w) > 2]
-    
-    if not keywords: return None
-
-    best_chunk = None
-    max_score = 0
-
-    for item in chunks:
-        chunk_text = item['text'].lower()
-        # Count how many unique keywords appear in this chunk
-        score = sum(1 for word in keywords if word in chunk_text)
-        
-        if score > max_score:
-            max_score = score
-            best_chunk = item
-
-    # Threshold: At least 40% of unique keywords must match to prevent "guessing"
-    threshold = len(keywords) * 0.4
-    if max_score >= max(1, threshold):
-        return best_chunk
-    return None
+    with METRICS.time("ask", "tokenize"):
+        keywords = question_keywords(question)
+    if not keywords: return []
+
+    # 2. Near-identical questions (same keywords in any order) share a cache entry
+    key = (mode, strict, top_k, tuple(sorted(keywords)))
+    index = None
+    if SEGMENTS:
+        # The live segment generation is part of the key, so an upload published
+        # by any worker process makes this worker's cached results miss
+        with METRICS.time("ask", "load"):
+            index = SEGMENTS.get(user, subject)
+        if index is not None:
+            key += (index.generation,)
+            if (user, subject) in USER_KNOWLEDGE:
+                # Published since this process last had to answer from memory
+                with KNOWLEDGE_LOCK:
+                    USER_KNOWLEDGE.pop((user, subject), None)
+        elif ("rebuild", user, subject) in SEGMENT_JOBS or STORE.has_chunks(user, subject):
+            # Not published yet (or still in the old segment layout): build it in
+            # the background and answer from the in-memory index meanwhile
+            in_background("rebuild", rebuild_segments, user, subject)
+        else:
+            return []
+
+    with METRICS.time("ask", "cache"):
+        cached = QUERY_CACHE.get(user, subject, key)
+    if cached is not None:
+        return cached
+    generation = QUERY_CACHE.generation(user, subject)
+    if index is None:
+        with METRICS.time("ask", "load"):
+            index = get_index(user, subject)
+
+    with METRICS.time("ask", "score"):
+        if mode == "tfidf":
+            # Cosine similarity over the whole subject's sparse TF-IDF matrix
+            matches = index.search_tfidf(keywords, top_k=top_k)
+        else:
+            # 3. Score only the chunks in the keywords' postings. Strict mode keeps the
+            # old rule: at least 40% of unique keywords must match to prevent "guessing"
+            matches = index.search(keywords, top_k=top_k, strict=strict, threshold=0.4)
+
+    QUERY_CACHE.put(user, subject, generation, key, matches)
+    return matches
+
+# -----------------------------------------
+# INSTRUMENTATION
+# -----------------------------------------
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    if PROFILER:
+        g.profile = PROFILER.start()
+
+@app.after_request
+def record_timing(response):
+    METRICS.observe(request.endpoint or "unknown", "total", time.perf_counter() - g.started)
+    return response
+
+@app.teardown_request
+def stop_profiler(exc):
+    # Teardown runs even when the view raised, so the profiler is always released
+    if PROFILER:
+        PROFILER.stop(g.pop("profile", None), request.endpoint or "unknown")
+
+def refresh_gauges():
+    # Per-subject gauges are rebuilt on each scrape, so evicted subjects drop out
+    series = {"subject_chunks": [], "subject_terms": [], "segment_count": [], "segment_generation": []}
+    with KNOWLEDGE_LOCK:
+        for (user, subject), index in USER_KNOWLEDGE.items():
+            labels = {"user": user, "subject": subject}
+            series["subject_chunks"].append((labels, len(index)))
+            series["subject_terms"].append((labels, len(index.vocab)))
+    if SEGMENTS:
+        for (user, subject), (_, segments) in list(SEGMENTS.sets.items()):
+            labels = {"user": user, "subject": subject}
+            series["subject_chunks"].append((labels, len(segments)))
+            series["segment_count"].append((labels, len(segments.segments)))
+            series["segment_generation"].append((labels, segments.generation))
+    for name, values in series.items():
+        METRICS.replace_gauges(name, values)
+    METRICS.set_gauge("loaded_subjects", {}, len(USER_KNOWLEDGE))
+    METRICS.set_gauge("ingest_queue_pending", {}, INGEST_QUEUE.pending_jobs())
+    METRICS.set_gauge("query_cache_entries", {}, len(QUERY_CACHE.entries))
 
 # -----------------------------------------
 # ROUTES
 # -----------------------------------------
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    refresh_gauges()
+    if request.args.get("format") == "json":
+        return jsonify(METRICS.as_dict())
+    return Response(METRICS.prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/login", methods=["POST"])
 def login():
     data = request.json
@@ -109,43 +361,85 @@ def upload():
         os.makedirs(path, exist_ok=True)
         fname = secure_filename(file.filename)
         fpath = os.path.join(path, fname)
-        file.save(fpath)
+        with METRICS.time("upload", "save"):
+            tmp_path, content_hash = save_upload(file, path)
 
-        content = extract_text(fpath, fname)
-        if user not in USER_KNOWLEDGE: USER_KNOWLEDGE[user] = {}
-        if subject not in USER_KNOWLEDGE[user]: USER_KNOWLEDGE[user][subject] = []
-        
-        USER_KNOWLEDGE[user][subject].extend(paragraphs)
+        with METRICS.time("upload", "dedup"):
+            # None when this file is already in the subject or still being added to it
+            document_id = STORE.add_document(user, subj, fname, content_hash)
+        if document_id is None:
+            os.remove(tmp_path)
+            return jsonify({"status": "success", "duplicate": True, "message": f"{fname} is already in your {subj} notes"})
 
-        return jsonify({"status": "success", "message": f"Learned from {filename}"})
+        with METRICS.time("upload", "dedup"):
+            cached = STORE.cached_chunks(content_hash)
+        if cached is not None:
+            with METRICS.time("upload", "index"):
+                result = add_cached_document(user, subj, fname, document_id, cached)
+            os.replace(tmp_path, fpath)
+            return jsonify({"status": "success", **result})
+
+        try:
+            with METRICS.time("upload", "enqueue"):
+                job_id = INGEST_QUEUE.submit(user, subj=subj, fpath=tmp_path, fname=fname,
+                                             document_id=document_id, content_hash=content_hash)
+        except QueueFull:
+            STORE.remove_document(document_id)
+            os.remove(tmp_path)
+            raise
+        return jsonify({"status": "queued", "job_id": job_id, "message": f"Learning from {fname}"}), 202
+    except QueueFull as e:
+        return jsonify({"status": "error", "message": str(e)}), 429
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/upload/<job_id>", methods=["GET"])
+def upload_status(job_id):
+    job = INGEST_QUEUE.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify(job)
+
 @app.route("/ask", methods=["POST"])
 def ask():
     data = request.json
     user = data.get("user", "").lower()
     subject = data.get("subject", "").lower()
     question = data.get("question", "")
+    top_k = data.get("top_k", 3)
+    # JSON integers only, so 2.7 or true aren't quietly read as 2 or 1
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+        return jsonify({"status": "error", "message": f"top_k must be a whole number from 1 to {MAX_TOP_K}"}), 400
+    strict = parse_flag(data.get("strict", True))
+    if strict is None:
+        return jsonify({"status": "error", "message": "strict must be true or false"}), 400
+    mode = data.get("mode", "strict")
+    if not isinstance(mode, str) or mode.lower() not in RETRIEVAL_MODES:
+        return jsonify({"status": "error", "message": f"Unknown mode {mode!r}, use one of {sorted(RETRIEVAL_MODES)}"}), 400
+    mode = mode.lower()
 
     # Check for greetings
     if question.lower().strip() in ["hi", "hello", "hey"]:
         return jsonify({"answer": f"Hi {user.capitalize()}, I'm ready. Ask me anything about your {subject} notes!"})
 
-    chunks = USER_KNOWLEDGE.get(user, {}).get(subject, [])
-    match = find_best_match(question, chunks)
+    matches = find_best_match(question, user, subject, top_k=top_k, strict=strict, mode=mode)
 
-    if match:
-        return jsonify({
-            "answer": match['text'],
-            "citation": match['ref'],
-            "confidence": "High"
-        })
+    if matches:
+        best, _ = matches[0]
+        with METRICS.time("ask", "serialize"):
+            return jsonify({
+                "answer": best.text,
+                "citation": best.ref,
+                "confidence": "High",
+                "results": [{"text": c.text, "citation": c.ref, "score": round(s, 4)} for c, s in matches]
+            })
 
     return jsonify({
-        "answer": f"I'm sorry, I couldn't find a specific match for that in your {subject} notes. [Strict Mode]",
+        "answer": f"I'm sorry, I couldn't find a specific match for that in your {subject} notes. [{'TF-IDF' if mode == 'tfidf' else 'Strict'} Mode]",
         "citation": None
     })
 
 if __name__ == "__main__":
+    # Nothing is ingesting yet, so anything incomplete was cut off by a restart
+    STORE.discard_incomplete()
     app.run(debug=True, port=5000)
@@ -0,0 +1,174 @@
+"""End-to-end retrieval benchmark through the Flask test client.
+
+Builds synthetic subjects of increasing size, then replays a mix of
+repeated and unique questions at several concurrency levels in both
+retrieval modes. The report (JSON) includes client-side latency
+percentiles, throughput and the per-stage breakdown from /metrics.
+Pass --baseline to compare against an earlier report and flag
+regressions.
+
+Run from the backend folder:
+    python benchmarks/bench_app.py --out bench.json
+    python benchmarks/bench_app.py --baseline bench.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+SIZES = [100, 1000, 10000]
+CONCURRENCY = [1, 4, 8]
+MODES = ["strict", "tfidf"]
+QUESTIONS_PER_RUN = 400
+# Share of questions drawn from a small pool, like a class asking the same thing
+REPEAT_SHARE = 0.5
+# p50 is compared; p99 on a shared box is too noisy to gate on
+REGRESSION_TOLERANCE = 0.25
+
+TOPICS = ["cell", "membrane", "nucleus", "protein", "enzyme", "tissue", "organ", "respiration",
+          "photosynthesis", "chlorophyll", "mitosis", "meiosis", "gamete", "zygote", "embryo",
+          "hormone", "neuron", "synapse", "kidney", "nephron", "artery", "vein", "ventricle"]
+FILLER = [f"term{i}" for i in range(5000)]
+
+
+def synthetic_notes(n_chunks, rng):
+    paragraphs = []
+    for _ in range(n_chunks):
+        words = rng.choices(TOPICS, k=8) + rng.choices(FILLER, k=40)
+        rng.shuffle(words)
+        paragraphs.append(" ".join(words) + ".")
+    return "\n\n".join(paragraphs).encode()
+
+
+def question_mix(rng):
+    pool = [" ".join(rng.sample(TOPICS, 3)) for _ in range(10)]
+    questions = []
+    for _ in range(QUESTIONS_PER_RUN):
+        if rng.random() < REPEAT_SHARE:
+            questions.append(rng.choice(pool))
+        else:
+            questions.append(" ".join(rng.sample(TOPICS, 2) + rng.sample(FILLER, 2)))
+    return questions
+
+
+def wait_for(client, job_id):
+    while True:
+        job = client.get(f"/upload/{job_id}").get_json()
+        if job["state"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def replay(app, user, subject, questions, mode, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    shards = [questions[i::concurrency] for i in range(concurrency)]
+
+    def worker(shard):
+        client = app.test_client()
+        local = []
+        for question in shard:
+            start = time.perf_counter()
+            client.post("/ask", json={"user": user, "subject": subject, "question": question, "mode": mode})
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(shard,)) for shard in shards]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies),
+        "qps": len(latencies) / wall,
+    }
+
+
+def run():
+    workdir = tempfile.mkdtemp(prefix="askmynotes-bench-")
+    os.chdir(workdir)
+    os.environ["KNOWLEDGE_DB"] = os.path.join(workdir, "knowledge.db")
+    from app import app
+
+    client = app.test_client()
+    results = []
+    for size in SIZES:
+        rng = random.Random(size)
+        user, subject = "bench", f"subject{size}"
+        res = client.post("/upload", data={"user": user, "subject": subject,
+                                           "file": (io.BytesIO(synthetic_notes(size, rng)), f"notes{size}.txt")})
+        job = wait_for(client, res.get_json()["job_id"])
+        for mode in MODES:
+            for concurrency in CONCURRENCY:
+                # A fresh mix per run, so earlier runs don't warm this one's cache
+                questions = question_mix(random.Random(f"{size}-{mode}-{concurrency}"))
+                stats = replay(app, user, subject, questions, mode, concurrency)
+                results.append({"chunks": job["result"]["chunks"], "mode": mode, "concurrency": concurrency, **stats})
+                print(f"{size:>6} chunks {mode:>6} x{concurrency:<2} "
+                      f"p50 {stats['p50_ms']:7.3f} ms  p99 {stats['p99_ms']:7.3f} ms  {stats['qps']:8.0f} q/s")
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "results": results,
+        "stages": client.get("/metrics?format=json").get_json()["stages"],
+    }
+
+
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    key = lambda r: (r["chunks"], r["mode"], r["concurrency"])
+    previous = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        old = previous.get(key(r))
+        if old and r["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{key(r)}: p50 {old['p50_ms']:.3f} -> {r['p50_ms']:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="allowed p50 slowdown vs the baseline (default %(default)s)")
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report = run()
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
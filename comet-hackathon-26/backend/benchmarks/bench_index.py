@@ -0,0 +1,45 @@
+"""Query latency of the BM25 inverted index as a subject grows.
+
+Run from the backend folder:  python benchmarks/bench_index.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.inverted_index import InvertedIndex
+
+SIZES = [10, 100, 1000, 10000]
+VOCAB = [f"term{i}" for i in range(50000)]
+QUERY = ["mitochondria", "respiration", "cell"]
+QUERIES = 500
+
+
+def build_index(n_chunks, rng):
+    index = InvertedIndex()
+    for i in range(n_chunks):
+        tokens = rng.sample(VOCAB, 40)
+        # Plant the query terms in a fixed number of chunks so every corpus
+        # size has the same number of real candidates.
+        if i < 10:
+            tokens += QUERY
+        index.add(" ".join(tokens), f"chunk {i}", tokens)
+    return index
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'chunks':>8} {'avg query (us)':>16}")
+    for size in SIZES:
+        index = build_index(size, rng)
+        start = time.perf_counter()
+        for _ in range(QUERIES):
+            index.search(QUERY, top_k=3)
+        elapsed = (time.perf_counter() - start) / QUERIES
+        print(f"{size:>8} {elapsed * 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
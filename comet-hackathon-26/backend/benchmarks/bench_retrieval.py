@@ -0,0 +1,82 @@
+"""Recall and latency of strict (BM25) vs tfidf retrieval.
+
+The sample biology PDF is chunked, then scaled up synthetically by adding
+perturbed copies of its chunks. Each query is a few keywords sampled from
+one chunk; recall@k counts how often that exact chunk is returned.
+
+Run from the backend folder:  python benchmarks/bench_retrieval.py
+"""
+import os
+import random
+import sys
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from utils.chunker import Chunker
+from utils.extractor import iter_pages
+from utils.inverted_index import InvertedIndex
+
+SAMPLE_PDF = os.path.join(BACKEND, "uploads", "sujal", "biology", "topic1zoo.pdf")
+SCALES = [1, 10, 100, 1000]
+QUERIES = 200
+TOP_K = 3
+
+
+def base_chunks():
+    chunker = Chunker()
+    chunks = []
+    for page in iter_pages(SAMPLE_PDF, "topic1zoo.pdf"):
+        chunks.extend(chunker.chunk_page(page))
+    return chunks
+
+
+def perturb(tokens, vocab, rng, rate=0.3):
+    return [rng.choice(vocab) if rng.random() < rate else t for t in tokens]
+
+
+def build(chunks, scale, rng):
+    vocab = sorted({t for _, _, tokens in chunks for t in tokens})
+    index = InvertedIndex()
+    corpus = []
+    for copy in range(scale):
+        for locator, text, tokens in chunks:
+            tokens = tokens if copy == 0 else perturb(tokens, vocab, rng)
+            index.add(text, f"copy {copy}, {locator}", tokens)
+            corpus.append(tokens)
+    return index, corpus
+
+
+def run(index, corpus, rng, search):
+    targets = [rng.randrange(len(corpus)) for _ in range(QUERIES)]
+    queries = [rng.sample(corpus[t], min(4, len(corpus[t]))) for t in targets]
+    search(index, queries[0])  # warm up (builds the TF-IDF matrix)
+
+    found = 0
+    start = time.perf_counter()
+    for target, query in zip(targets, queries):
+        results = search(index, query)
+        found += any(chunk is index.chunks[target] for chunk, _ in results)
+    elapsed = (time.perf_counter() - start) / QUERIES
+    return found / QUERIES, elapsed * 1000
+
+
+MODES = {
+    "strict": lambda index, q: index.search(q, top_k=TOP_K, strict=True),
+    "tfidf": lambda index, q: index.search_tfidf(q, top_k=TOP_K),
+}
+
+
+def main():
+    chunks = base_chunks()
+    print(f"{'chunks':>8} {'mode':>8} {'recall@' + str(TOP_K):>10} {'avg ms':>8}")
+    for scale in SCALES:
+        index, corpus = build(chunks, scale, random.Random(scale))
+        for mode, search in MODES.items():
+            recall, ms = run(index, corpus, random.Random(1), search)
+            print(f"{len(corpus):>8} {mode:>8} {recall:>10.2f} {ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Read throughput over a shared segment as worker processes are added.
+
+Each process maps the same segment file and runs BM25 queries; the report
+shows aggregate queries/s and how much private memory each worker needed
+(the mapped corpus itself is shared through the page cache), then how long
+publishing one more upload into that subject takes, the background merge
+that follows, and a merge of the whole subject for comparison.
+
+Run from the backend folder:  python benchmarks/bench_segments.py
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import chain
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from utils.segments import SegmentCatalog, write_segment
+
+CHUNKS = 100000
+UPLOAD_CHUNKS = 50
+SECONDS = 3
+VOCAB = [f"term{i}" for i in range(50000)]
+
+
+def private_kb():
+    # Anonymous (heap) memory from /proc, Linux only; mapped segment pages are
+    # file-backed and shared, so they don't count here
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Anonymous:"):
+                return int(line.split()[1])
+    return 0
+
+
+def worker(root, seed, results):
+    catalog = SegmentCatalog(root)
+    before = private_kb()
+    segment = catalog.get("bench", "biology")
+    rng = random.Random(seed)
+    queries = 0
+    deadline = time.perf_counter() + SECONDS
+    while time.perf_counter() < deadline:
+        segment.search(rng.sample(VOCAB, 3), top_k=3, strict=False)
+        queries += 1
+    results.put((queries, private_kb() - before))
+
+
+def main():
+    root = tempfile.mkdtemp(prefix="askmynotes-segments-")
+    rng = random.Random(0)
+    catalog = SegmentCatalog(root)
+    catalog.rebuild("bench", "biology", lambda: [(1, (
+        (f"chunk {i}", f"notes.pdf, para {i}", rng.choices(VOCAB, k=60)) for i in range(CHUNKS)
+    ))])
+    directory = os.path.join(root, "bench", "biology")
+    size_mb = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(".seg")) / 1e6
+    print(f"segment: {CHUNKS} chunks, {size_mb:.1f} MB on disk, {os.cpu_count()} cpus")
+    print(f"{'workers':>8} {'queries/s':>10} {'heap MB/worker':>15}")
+
+    for n in sorted({1, 2, 4, os.cpu_count() or 1}):
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(root, i, results)) for i in range(n)]
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        qps = sum(q for q, _ in outcomes) / SECONDS
+        private = sum(kb for _, kb in outcomes) / n / 1024
+        print(f"{n:>8} {qps:>10.0f} {private:>15.1f}")
+
+    # Publishing an upload writes only that document; the merge runs off the request path
+    appends = []
+    for document_id in range(2, 2 + catalog.max_segments):
+        upload = [(f"new {i}", f"upload.pdf, para {i}", rng.choices(VOCAB, k=60)) for i in range(UPLOAD_CHUNKS)]
+        start = time.perf_counter()
+        catalog.append("bench", "biology", document_id, upload)
+        appends.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    catalog.merge("bench", "biology")
+    merge = time.perf_counter() - start
+    # The merge policy only folds the new, smaller segments; the last one is the result
+    segments = catalog.get("bench", "biology").segments
+    print(f"publish one {UPLOAD_CHUNKS}-chunk upload: {1000 * max(appends):.1f} ms (worst of {len(appends)})")
+    print(f"background merge of the {len(appends)} uploads ({len(segments[-1])} chunks): {1000 * merge:.0f} ms")
+
+    # What a merge of the whole subject costs, once the new segments have outgrown the oldest
+    start = time.perf_counter()
+    write_segment(os.path.join(root, "full-merge.seg"), chain.from_iterable(s.iter_chunks() for s in segments))
+    print(f"full merge of {sum(len(s) for s in segments)} chunks: {1000 * (time.perf_counter() - start):.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""/ask latency while 20 uploads are being ingested in the background.
+
+Every question is different, so the query cache never answers one, and
+the asks go to a subject that is itself receiving some of the uploads.
+"loaded" asks only while ingest jobs are in flight; "after" repeats the
+run once they finish, on the same (now larger) subject, to separate
+contention from the growth of the subject.
+
+Run from the backend folder:  python benchmarks/load_upload_ask.py
+"""
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+UPLOADS = 20
+# Uploads that land in the asked subject; the rest go to other students
+SAME_SUBJECT_UPLOADS = 4
+ASKS = 500
+WORDS = ["cell", "membrane", "nucleus", "protein", "enzyme", "tissue", "organ",
+         "respiration", "photosynthesis", "chlorophyll", "mitosis", "meiosis"]
+FILLER = [f"term{i}" for i in range(2000)]
+
+
+def synthetic_notes(rng, paragraphs=2000):
+    return "\n\n".join(" ".join(rng.choices(WORDS, k=50) + rng.choices(FILLER, k=10))
+                       for _ in range(paragraphs)).encode()
+
+
+def questions(rng, n):
+    return [" ".join(rng.sample(WORDS, 2) + rng.sample(FILLER, 2)) for _ in range(n)]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def wait_for(client, job_id):
+    while client.get(f"/upload/{job_id}").get_json()["state"] in ("queued", "running"):
+        time.sleep(0.05)
+
+
+def measure_asks(client, batch):
+    samples = []
+    for question in batch:
+        start = time.perf_counter()
+        client.post("/ask", json={"user": "roshni", "subject": "biology", "question": question})
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="askmynotes-load-")
+    os.chdir(workdir)
+    os.environ["KNOWLEDGE_DB"] = os.path.join(workdir, "knowledge.db")
+    from app import app
+
+    rng = random.Random(7)
+    client = app.test_client()
+    res = client.post("/upload", data={"user": "roshni", "subject": "biology",
+                                       "file": (io.BytesIO(synthetic_notes(rng, 200)), "base.txt")})
+    wait_for(client, res.get_json()["job_id"])
+
+    idle = measure_asks(client, questions(rng, ASKS))
+
+    job_ids = []
+    lock = threading.Lock()
+
+    def upload(i):
+        c = app.test_client()
+        user = "roshni" if i < SAME_SUBJECT_UPLOADS else f"student{i}"
+        res = c.post("/upload", data={"user": user, "subject": "biology",
+                                      "file": (io.BytesIO(synthetic_notes(random.Random(i))), f"notes{i}.txt")})
+        with lock:
+            job_ids.append(res.get_json().get("job_id"))
+
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(UPLOADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    def in_flight():
+        states = [client.get(f"/upload/{job_id}").get_json()["state"] for job_id in job_ids if job_id]
+        return sum(state in ("queued", "running") for state in states)
+
+    loaded = []
+    while in_flight() and len(loaded) < 20 * ASKS:
+        loaded += measure_asks(client, questions(rng, 50))
+    after = measure_asks(client, questions(rng, ASKS))
+
+    print(f"uploads submitted: {len(job_ids)} ({SAME_SUBJECT_UPLOADS} to the asked subject)")
+    print(f"{'':>10} {'asks':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, samples in (("idle", idle), ("loaded", loaded), ("after", after)):
+        if not samples:
+            continue
+        print(f"{label:>10} {len(samples):>6} {statistics.median(samples):>8.2f} {percentile(samples, 99):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
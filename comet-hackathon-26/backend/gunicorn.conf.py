@@ -0,0 +1,28 @@
+# Production serving:  gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+# Workers serve /ask from memory-mapped index segments, so the corpus is held
+# once in the page cache rather than once per worker
+os.environ.setdefault("SEGMENT_DIR", "segments")
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# One PDF extraction pool per worker; split the CPUs between them rather than
+# giving each worker a process per CPU
+os.environ.setdefault("EXTRACT_PROCESSES", str(max(1, multiprocessing.cpu_count() // workers)))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+# Each worker opens its own SQLite connection and ingest threads after forking
+preload_app = False
+
+
+def on_starting(server):
+    # Runs once in the master before any worker can start an ingest, so every
+    # incomplete document was cut off by the last shutdown
+    from utils.knowledge_store import KnowledgeStore
+
+    store = KnowledgeStore(os.getenv("KNOWLEDGE_DB", "knowledge.db"))
+    removed = store.discard_incomplete()
+    store.close()
+    if removed:
+        server.log.info("Discarded %d partially ingested documents", removed)
@@ -0,0 +1,160 @@
+import re
+from array import array
+
+from utils.text_cleaner import extract_keywords
+
+# Paragraphs longer than MAX_WORDS are cut into overlapping windows
+MAX_WORDS = 200
+WINDOW_WORDS = 150
+OVERLAP_WORDS = 30
+
+NUMBERED_HEADING = re.compile(r'^(\d+(?:\.\d+)*\.?)\s+([A-Z].*)$')
+# Image credits and similar captions; dropped, and never taken as a heading
+CREDIT_LINE = re.compile(
+    r'shutterstock|getty ?images|istock|alamy|dreamstime|adobe stock|wikimedia|©'
+    r'|\b(image|photo|picture) (credit|source|courtesy)|^(credits?|source|courtesy)\s*:',
+    re.IGNORECASE,
+)
+BULLETS = "•◦▪●○■–-*"
+
+
+class Vocabulary:
+    """Maps terms to small integer ids so chunks can store arrays, not strings."""
+
+    __slots__ = ("ids", "terms")
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def encode(self, tokens):
+        ids = self.ids
+        out = array('I')
+        for term in tokens:
+            term_id = ids.get(term)
+            if term_id is None:
+                term_id = ids[term] = len(self.terms)
+                self.terms.append(term)
+            out.append(term_id)
+        return out
+
+    def lookup(self, tokens):
+        return [self.ids[term] for term in tokens if term in self.ids]
+
+    def decode(self, term_ids):
+        return [self.terms[i] for i in term_ids]
+
+
+class Chunk:
+    __slots__ = ("text", "ref", "terms")
+
+    def __init__(self, text, ref, terms):
+        self.text = text
+        self.ref = ref
+        self.terms = terms
+
+    def __repr__(self):
+        return f"Chunk({self.ref!r})"
+
+
+def is_credit(line):
+    return len(line.split()) <= 8 and bool(CREDIT_LINE.search(line))
+
+
+def is_heading(line):
+    line = line.strip()
+    words = line.split()
+    if not words or len(words) > 10 or line[-1] in ".,;:!?" or is_credit(line):
+        return False
+    return bool(NUMBERED_HEADING.match(line)) or line.isupper() or line.istitle()
+
+
+def split_heading(line):
+    """Return (heading, rest) for a heading line, or (None, line).
+
+    PDF text often runs a numbered heading into its first sentence
+    ("3. Gametogenesis The primary sex organs ..."); the heading is cut
+    where a capitalised word is followed by a lowercase one.
+    """
+    match = NUMBERED_HEADING.match(line)
+    if match:
+        words = match.group(2).split()
+        for i in range(1, min(len(words) - 1, 9)):
+            if words[i][0].isupper() and words[i + 1][0].islower():
+                return f"{match.group(1)} {' '.join(words[:i])}", " ".join(words[i:])
+    if is_heading(line):
+        return " ".join(line.split()), ""
+    return None, line
+
+
+def windows(words):
+    if len(words) <= MAX_WORDS:
+        yield words
+        return
+    step = WINDOW_WORDS - OVERLAP_WORDS
+    for start in range(0, len(words), step):
+        yield words[start:start + WINDOW_WORDS]
+        if start + WINDOW_WORDS >= len(words):
+            break
+
+
+class Chunker:
+    """Turns page records into cited chunks.
+
+    Pages are read line by line, since PDF text rarely has blank lines.
+    A paragraph ends at a blank line, a bullet or a heading; any line that
+    looks like a heading starts a new section, carried across pages until
+    the next one. Image credits are dropped. Each chunk is returned as
+    (locator, text, tokens), where tokens come from the same keyword
+    extraction used for questions.
+    """
+
+    def __init__(self):
+        self.section = None
+        self.para = 0
+
+    def chunk_page(self, page):
+        chunks = []
+        lines = []
+        self.para = 0
+        for line in page['text'].splitlines():
+            line = line.strip()
+            if line[:1] in BULLETS and line[1:2] in ("", " "):
+                # A bullet starts a new paragraph; PDFs often put the marker on its own line
+                self._paragraph(page, lines, chunks)
+                line = line[1:].strip()
+            if not line:
+                self._paragraph(page, lines, chunks)
+                continue
+            if is_credit(line):
+                continue
+            heading, rest = split_heading(line)
+            if heading:
+                self._paragraph(page, lines, chunks)
+                self.section = heading
+            if rest:
+                lines.append(rest)
+        self._paragraph(page, lines, chunks)
+        return chunks
+
+    def _paragraph(self, page, lines, chunks):
+        # Emits the buffered lines as one paragraph (windowed if long) and clears the buffer
+        words = " ".join(lines).split()
+        lines.clear()
+        if not words:
+            return
+
+        self.para += 1
+        locator = f"page {page['page']}"
+        if self.section:
+            locator += f", {self.section}"
+        locator += f", para {self.para}"
+
+        parts = list(windows(words))
+        for i, part in enumerate(parts, 1):
+            text = " ".join(part)
+            suffix = f" part {i}" if len(parts) > 1 else ""
+            chunks.append((locator + suffix, text, extract_keywords(text)))
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # pymupdf
+from docx import Document
+
+# PDFs with at least this many pages are split across the process pool
+PARALLEL_MIN_PAGES = 40
+PAGES_PER_BATCH = 20
+# Non-paginated formats are cut into pseudo-pages of roughly this size, at a
+# blank line where possible and at any line break once a page hits the hard cap
+PAGE_CHARS = 4000
+MAX_PAGE_CHARS = 2 * PAGE_CHARS
+# Extraction processes per server process; gunicorn.conf.py splits the CPUs
+# between its workers so the whole deployment runs about one per CPU
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", os.cpu_count() or 1))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # Started from an ingest thread of a threaded server, so fork would copy
+            # locks other threads hold; the forkserver only preloads this module
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _POOL = ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES, mp_context=context)
+        return _POOL
+
+
+def _extract_pdf_range(file_path, start, stop):
+    # Runs in a worker process; each worker opens its own handle
+    with fitz.open(file_path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _iter_pdf(file_path):
+    with fitz.open(file_path) as doc:
+        page_count = doc.page_count
+        if page_count < PARALLEL_MIN_PAGES or EXTRACT_PROCESSES < 2:
+            for number, page in enumerate(doc, 1):
+                yield number, page.get_text()
+            return
+
+    pool = _get_pool()
+    ranges = [(s, min(s + PAGES_PER_BATCH, page_count)) for s in range(0, page_count, PAGES_PER_BATCH)]
+    # Keep only a couple of batches per worker in flight so memory stays
+    # proportional to a page batch rather than the whole document
+    max_in_flight = 2 * EXTRACT_PROCESSES
+    pending = []
+    next_range = 0
+    while pending or next_range < len(ranges):
+        while next_range < len(ranges) and len(pending) < max_in_flight:
+            start, stop = ranges[next_range]
+            pending.append((start, pool.submit(_extract_pdf_range, file_path, start, stop)))
+            next_range += 1
+        start, future = pending.pop(0)
+        for offset, text in enumerate(future.result()):
+            yield start + offset + 1, text
+
+
+def _iter_paragraph_pages(paragraphs):
+    page, size, number = [], 0, 1
+    for para in paragraphs:
+        page.append(para)
+        size += len(para)
+        if (size >= PAGE_CHARS and not para.strip()) or size >= MAX_PAGE_CHARS:
+            yield number, "".join(page)
+            page, size, number = [], 0, number + 1
+    if page:
+        yield number, "".join(page)
+
+
+def _iter_docx(file_path):
+    doc = Document(file_path)
+
+    def lines():
+        # A blank line after each paragraph keeps them separate for the chunker
+        for para in doc.paragraphs:
+            yield para.text + "\n"
+            yield "\n"
+
+    yield from _iter_paragraph_pages(lines())
+
+
+def _iter_txt(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from _iter_paragraph_pages(f)
+
+
+def page_count(file_path, filename):
+    """Total pages for progress reporting; None when the format isn't paginated."""
+    if filename.split('.')[-1].lower() == 'pdf':
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    return None
+
+
+def iter_pages(file_path, filename):
+    """Stream page-level records: {'page', 'text', 'source'}."""
+    ext = filename.split('.')[-1].lower()
+    if ext == 'pdf':
+        pages = _iter_pdf(file_path)
+    elif ext == 'docx':
+        pages = _iter_docx(file_path)
+    elif ext == 'txt':
+        pages = _iter_txt(file_path)
+    else:
+        return
+
+    for number, text in pages:
+        yield {"page": number, "text": text, "source": filename}
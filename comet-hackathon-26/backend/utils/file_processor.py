@@ -6,21 +6,21 @@ from config import PROCESSED_FOLDER
 def process_file(subject, file_path, filename):
     ext = filename.rsplit(".", 1)[1].lower()
 
-    text_content = ""
-
-    if ext == "pdf":
-        reader = PdfReader(file_path)
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text_content += page_text
+    # Append processed lowercase text so earlier uploads aren't rewritten,
+    # writing page by page instead of building one big string
+    processed_path = os.path.join(PROCESSED_FOLDER, f"{subject}.txt")
 
-    elif ext == "txt":
-        with open(file_path, "r", encoding="utf-8") as f:
-            text_content = f.read()
+    with open(processed_path, "a", encoding="utf-8") as f:
+        if ext == "pdf":
+            reader = PdfReader(file_path)
+            for page in reader.pages:
+                page_text = page.extract_text()
+                if page_text:
+                    f.write(page_text.lower())
 
-    # Save processed lowercase text
-    processed_path = os.path.join(PROCESSED_FOLDER, f"{subject}.txt")
+        elif ext == "txt":
+            with open(file_path, "r", encoding="utf-8") as src:
+                for line in src:
+                    f.write(line.lower())
 
-    with open(processed_path, "w", encoding="utf-8") as f:
-        f.write(text_content.lower())
\ No newline at end of file
+        f.write("\n")
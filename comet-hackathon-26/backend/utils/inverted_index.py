@@ -0,0 +1,105 @@
+import heapq
+import math
+import threading
+from array import array
+
+from utils.chunker import Chunk, Vocabulary
+from utils.tfidf import TfidfMatrix, search_snapshot
+
+
+class InvertedIndex:
+    """Per-user, per-subject index: term -> postings of (chunk_id, term frequency).
+
+    Terms are stored as vocabulary ids and postings as pairs of integer
+    arrays, so a subject with 100k chunks stays compact in memory.
+
+    Callers serialise `add`; searches may run alongside it. Everything a
+    search can reach (term ids, chunk ids) is published only after the
+    structures it points into exist.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = Vocabulary()
+        self.postings = []
+        self.chunks = []
+        self.doc_lengths = array('I')
+        self.total_length = 0
+        self.tfidf = TfidfMatrix()
+        self.tfidf_rows = 0
+        self.tfidf_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add(self, text, ref, tokens):
+        # Grow postings before encode makes the new term ids visible to search
+        new_terms = len(set(tokens).difference(self.vocab.ids))
+        self.postings.extend((array('I'), array('I')) for _ in range(new_terms))
+        terms = self.vocab.encode(tokens)
+
+        chunk_id = len(self.chunks)
+        self.chunks.append(Chunk(text, ref, terms))
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+
+        counts = {}
+        for term_id in terms:
+            counts[term_id] = counts.get(term_id, 0) + 1
+        for term_id, tf in counts.items():
+            chunk_ids, tfs = self.postings[term_id]
+            chunk_ids.append(chunk_id)
+            tfs.append(tf)
+        return chunk_id
+
+    def search(self, keywords, top_k=3, strict=True, threshold=0.4):
+        """Rank candidate chunks with BM25.
+
+        Only chunks that appear in the postings of at least one keyword are
+        scored, so the cost depends on the posting lists touched rather than
+        on the size of the whole subject. In strict mode a chunk must contain
+        at least `threshold` of the unique keywords to be returned.
+        """
+        terms = list(dict.fromkeys(keywords))
+        n = len(self.chunks)
+        if not terms or not n:
+            return []
+
+        avg_len = self.total_length / n or 1
+        scores = {}
+        hits = {}
+
+        for term_id in self.vocab.lookup(terms):
+            chunk_ids, tfs = self.postings[term_id]
+            df = len(chunk_ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in zip(chunk_ids, tfs):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                hits[chunk_id] = hits.get(chunk_id, 0) + 1
+
+        if strict:
+            min_hits = max(1, len(terms) * threshold)
+            scores = {cid: s for cid, s in scores.items() if hits[cid] >= min_hits}
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.chunks[cid], score) for cid, score in best]
+
+    def search_tfidf(self, keywords, top_k=3):
+        """Rank every chunk by TF-IDF cosine similarity to the keywords."""
+        # Fold in chunks added since the last TF-IDF query; earlier rows are kept as-is.
+        # Only the fold holds the lock; scoring runs on the immutable snapshot.
+        with self.tfidf_lock:
+            n_chunks = len(self.chunks)
+            if self.tfidf_rows < n_chunks:
+                new_rows = [chunk.terms for chunk in self.chunks[self.tfidf_rows:n_chunks]]
+                self.tfidf.partial_fit(new_rows, len(self.vocab))
+                self.tfidf_rows = n_chunks
+            snapshot = self.tfidf.snapshot()
+
+        term_ids = self.vocab.lookup(keywords)
+        if snapshot is None or not term_ids:
+            return []
+        best = search_snapshot(snapshot, term_ids, top_k)
+        return [(self.chunks[cid], score) for cid, score in best]
@@ -0,0 +1,119 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestQueue:
+    """Bounded background queue for upload ingestion.
+
+    Jobs are queued per user and workers take them round-robin across
+    users, so one student uploading a whole shelf doesn't starve the rest
+    of the class. Submitting raises QueueFull when the queue (or that
+    user's share of it) is at capacity.
+
+    With a `store` (see KnowledgeStore.add_job), job state and the limits
+    are shared through it, so with several server processes any of them
+    can report on a job and the limits apply to all of them together.
+    Each process still runs only the jobs submitted to it.
+    """
+
+    def __init__(self, handler, workers=2, max_pending=50, max_per_user=5, max_finished=1000, store=None):
+        self.handler = handler
+        self.store = store
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.finished = deque()
+        self.queues = OrderedDict()
+        self.pending = 0
+        self.cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True).start()
+
+    def submit(self, user, **payload):
+        with self.cond:
+            user_queue = self.queues.get(user)
+            if self.store is None:
+                if self.pending >= self.max_pending:
+                    raise QueueFull("Upload queue is full, try again shortly")
+                if user_queue is not None and len(user_queue) >= self.max_per_user:
+                    raise QueueFull(f"{user} already has {self.max_per_user} uploads waiting")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id,
+                "user": user,
+                "state": "queued",
+                "pages_done": 0,
+                "pages_total": None,
+                "error": None,
+                "result": None,
+                "submitted_at": time.time(),
+            }
+            if self.store is not None:
+                self.store.add_job(job, self.max_pending, self.max_per_user)
+            self.jobs[job_id] = job
+            self.queues.setdefault(user, deque()).append((job_id, dict(payload, user=user)))
+            self.pending += 1
+            self.cond.notify()
+            return job_id
+
+    def status(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+        # Submitted to another process, or finished long enough ago to be retired here
+        return self.store.load_job(job_id) if self.store is not None else None
+
+    def pending_jobs(self):
+        return self.store.count_jobs("queued") if self.store is not None else self.pending
+
+    def _next_job(self):
+        # Caller holds self.cond; take from the user at the front, then move them to the back
+        user, user_queue = next(iter(self.queues.items()))
+        job_id, payload = user_queue.popleft()
+        if user_queue:
+            self.queues.move_to_end(user)
+        else:
+            del self.queues[user]
+        self.pending -= 1
+        return job_id, payload
+
+    def _update(self, job_id, **fields):
+        with self.cond:
+            self.jobs[job_id].update(fields)
+            job = dict(self.jobs[job_id])
+        if self.store is not None:
+            self.store.update_job(job)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queues:
+                    self.cond.wait()
+                job_id, payload = self._next_job()
+            self._update(job_id, state="running")
+
+            def progress(done, total=None):
+                self._update(job_id, pages_done=done, pages_total=total)
+
+            try:
+                result = self.handler(progress=progress, **payload)
+                self._update(job_id, state="done", result=result)
+            except Exception as e:
+                self._update(job_id, state="error", error=str(e))
+            self._retire(job_id)
+
+    def _retire(self, job_id):
+        # Keep a bounded history of finished jobs for the status endpoint
+        with self.cond:
+            self.finished.append(job_id)
+            while len(self.finished) > self.max_finished:
+                self.jobs.pop(self.finished.popleft(), None)
@@ -1,30 +1,43 @@
 import os
 from config import PROCESSED_FOLDER
+from utils.text_cleaner import extract_keywords, question_keywords
 
+# subject file -> (mtime, size, [(sentence, keyword set)]), tokenized once per file version
+_SENTENCE_CACHE = {}
 
-def search_answer(subject, question):
-    processed_path = os.path.join(PROCESSED_FOLDER, f"{subject}.txt")
 
-    if not os.path.exists(processed_path):
-        return None
+def _load_sentences(processed_path):
+    stat = os.stat(processed_path)
+    cached = _SENTENCE_CACHE.get(processed_path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
 
     with open(processed_path, "r", encoding="utf-8") as f:
         text = f.read()
 
-    question = question.lower()
-    words = question.split()
+    sentences = []
+    for sentence in text.split("."):
+        sentence = sentence.strip()
+        if sentence:
+            sentences.append((sentence, frozenset(extract_keywords(sentence))))
+
+    _SENTENCE_CACHE[processed_path] = (stat.st_mtime, stat.st_size, sentences)
+    return sentences
+
 
-    matched_sentences = []
+def search_answer(subject, question):
+    processed_path = os.path.join(PROCESSED_FOLDER, f"{subject}.txt")
+
+    if not os.path.exists(processed_path):
+        return None
 
-    sentences = text.split(".")
+    words = set(question_keywords(question))
+    if not words:
+        return None
 
-    for sentence in sentences:
-        for word in words:
-            if word in sentence:
-                matched_sentences.append(sentence.strip())
-                break
+    matched_sentences = [sentence for sentence, keywords in _load_sentences(processed_path) if words & keywords]
 
     if not matched_sentences:
         return None
 
-    return ". ".join(matched_sentences[:3])
\ No newline at end of file
+    return ". ".join(matched_sentences[:3])
@@ -0,0 +1,364 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.jobs import QueueFull
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    source TEXT NOT NULL,
+    content_hash TEXT,
+    complete INTEGER NOT NULL DEFAULT 0,
+    created_at REAL DEFAULT (julianday('now'))
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    user TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    text TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    tokens TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_by_subject ON chunks (user, subject, id);
+CREATE INDEX IF NOT EXISTS chunks_by_document ON chunks (document_id, id);
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    content_hash TEXT PRIMARY KEY,
+    nbytes INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL DEFAULT (julianday('now'))
+);
+CREATE TABLE IF NOT EXISTS cached_chunks (
+    content_hash TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    locator TEXT NOT NULL,
+    text TEXT NOT NULL,
+    tokens TEXT NOT NULL,
+    PRIMARY KEY (content_hash, seq)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    state TEXT NOT NULL,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    error TEXT,
+    result TEXT,
+    submitted_at REAL NOT NULL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, user);
+CREATE TABLE IF NOT EXISTS owners (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+"""
+JOB_FIELDS = ("job_id", "user", "state", "pages_done", "pages_total", "error", "result", "submitted_at")
+# Finished jobs are kept this long for the status endpoint
+JOB_HISTORY_SECONDS = 7 * 24 * 3600
+# A process that hasn't called heartbeat() for this long is taken to be gone
+OWNER_TIMEOUT_SECONDS = 120
+# Columns added after the first release, with the value older rows get
+MIGRATIONS = (
+    ("documents", "content_hash", "TEXT"),
+    # No way to tell which older documents finished; keep them all, as before
+    ("documents", "complete", "INTEGER NOT NULL DEFAULT 1"),
+    ("documents", "owner", "TEXT"),
+    ("extraction_cache", "owner", "TEXT"),
+    ("jobs", "owner", "TEXT"),
+)
+
+
+class KnowledgeStore:
+    """SQLite-backed chunk store that survives restarts.
+
+    Each chunk is stored with its already-tokenized terms, so a subject's
+    inverted index can be rebuilt on first access without re-extracting
+    any uploaded file. New documents are appended; nothing is rewritten.
+
+    Extracted chunks are also cached by the file's content hash and shared
+    across users and subjects, so a re-upload of a known file skips
+    extraction. The cache is capped at `cache_bytes` and evicts the least
+    recently used files first; subjects keep their own chunk copies, so
+    evicting an entry never affects a document that was built from it.
+    Only the ingest that claims an entry (`claim_cache`) may fill it.
+
+    A document is searchable once it is marked complete, and counts as a
+    duplicate from the moment it is added. Rows left incomplete by a
+    restart mid-ingest are removed by `discard_incomplete()`, which must
+    run before any ingest starts.
+
+    Documents, cache claims and jobs record the process that created them
+    (`owner`). Each serving process calls `heartbeat()` periodically; when
+    one stops (a crashed or recycled worker), the next heartbeat elsewhere
+    cleans up what it left in flight, the same way a restart would.
+
+    Ingest job state lives here too, so every worker process can report on
+    (and count towards the limits of) jobs that another worker is running.
+    """
+
+    def __init__(self, db_path, cache_bytes=512 * 1024 * 1024):
+        self.cache_bytes = cache_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        for table, column, definition in MIGRATIONS:
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        self.owner = uuid.uuid4().hex
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_by_hash ON documents (user, subject, content_hash)")
+
+    def add_document(self, user, subject, source, content_hash=None):
+        """Insert an incomplete document and return its id.
+
+        Returns None instead if the subject already has a document with this
+        content, finished or still being ingested by a live process. The
+        check and the insert share one transaction, so two concurrent uploads
+        of the same file can't both get in.
+        """
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so no other process can insert in between
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if content_hash is not None and self.conn.execute(
+                    """SELECT 1 FROM documents WHERE user = ? AND subject = ? AND content_hash = ?
+                       AND (complete = 1 OR owner IN (SELECT id FROM owners WHERE heartbeat >= ?))""",
+                    (user, subject, content_hash, time.time() - OWNER_TIMEOUT_SECONDS),
+                ).fetchone():
+                    self.conn.rollback()
+                    return None
+                cur = self.conn.execute(
+                    "INSERT INTO documents (user, subject, source, content_hash, complete, owner) VALUES (?, ?, ?, ?, 0, ?)",
+                    (user, subject, source, content_hash, self.owner),
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return cur.lastrowid
+
+    def finish_document(self, document_id):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE documents SET complete = 1 WHERE id = ?", (document_id,))
+
+    def remove_document(self, document_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            self.conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    def discard_incomplete(self):
+        """Drop documents and cache entries an interrupted ingest left half-written."""
+        with self.lock, self.conn:
+            removed = self._discard("1", (), "Interrupted by a server restart, please upload the file again")
+            self.conn.execute("DELETE FROM owners WHERE id != ?", (self.owner,))
+            self.conn.execute(
+                "DELETE FROM jobs WHERE state IN ('done', 'error') AND submitted_at < ?",
+                (time.time() - JOB_HISTORY_SECONDS,),
+            )
+        return removed
+
+    def heartbeat(self, timeout=OWNER_TIMEOUT_SECONDS):
+        """Mark this process alive, and discard what processes gone for `timeout` seconds left in flight.
+
+        Their queued and running jobs fail (which also frees their share of
+        the queue limits), and their incomplete documents and cache claims
+        are dropped. Returns the number of documents dropped.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO owners (id, heartbeat) VALUES (?, ?)", (self.owner, now))
+            gone = "owner IN (SELECT id FROM owners WHERE heartbeat < ?)"
+            removed = self._discard(
+                gone, (now - timeout,), "The server stopped while processing this upload, please upload the file again"
+            )
+            self.conn.execute("DELETE FROM owners WHERE heartbeat < ?", (now - timeout,))
+        return removed
+
+    def _discard(self, where, params, error):
+        # Caller holds the lock and an open transaction; `where` picks the owners to clean up after
+        self.conn.execute(
+            f"UPDATE jobs SET state = 'error', error = ? WHERE state IN ('queued', 'running') AND {where}",
+            (error,) + params,
+        )
+        self.conn.execute(
+            f"DELETE FROM chunks WHERE document_id IN (SELECT id FROM documents WHERE complete = 0 AND {where})",
+            params,
+        )
+        removed = self.conn.execute(f"DELETE FROM documents WHERE complete = 0 AND {where}", params).rowcount
+        for (content_hash,) in self.conn.execute(
+            f"SELECT content_hash FROM extraction_cache WHERE complete = 0 AND {where}", params
+        ).fetchall():
+            self._drop_cached(content_hash)
+        return removed
+
+    def add_chunks(self, document_id, user, subject, chunks):
+        """Append (text, ref, tokens) chunks to a document."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO chunks (document_id, user, subject, text, ref, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                [(document_id, user, subject, text, ref, " ".join(tokens)) for text, ref, tokens in chunks],
+            )
+
+    def has_chunks(self, user, subject):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM chunks WHERE user = ? AND subject = ? LIMIT 1", (user, subject)
+            ).fetchone() is not None
+
+    def load_chunks(self, user, subject):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT text, ref, tokens FROM chunks WHERE user = ? AND subject = ? ORDER BY id",
+                (user, subject),
+            ).fetchall()
+        for text, ref, tokens in rows:
+            yield text, ref, tokens.split()
+
+    def complete_documents(self, user, subject):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id FROM documents WHERE user = ? AND subject = ? AND complete = 1 ORDER BY id",
+                (user, subject),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def document_chunks(self, document_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT text, ref, tokens FROM chunks WHERE document_id = ? ORDER BY id", (document_id,)
+            ).fetchall()
+        for text, ref, tokens in rows:
+            yield text, ref, tokens.split()
+
+    def cached_chunks(self, content_hash):
+        """Return [(locator, text, tokens)] for a fully cached file, or None."""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT complete FROM extraction_cache WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if not row or not row[0]:
+                return None
+            self.conn.execute(
+                "UPDATE extraction_cache SET last_used = julianday('now') WHERE content_hash = ?",
+                (content_hash,),
+            )
+            rows = self.conn.execute(
+                "SELECT locator, text, tokens FROM cached_chunks WHERE content_hash = ? ORDER BY seq",
+                (content_hash,),
+            ).fetchall()
+        return [(locator, text, tokens.split()) for locator, text, tokens in rows]
+
+    def claim_cache(self, content_hash):
+        """Reserve the cache entry for a file; False if it exists or another ingest is filling it."""
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO extraction_cache (content_hash, owner) VALUES (?, ?)", (content_hash, self.owner)
+            )
+        return cur.rowcount == 1
+
+    def cache_chunks(self, content_hash, start_seq, chunks):
+        """Append (locator, text, tokens) chunks to an entry claimed with claim_cache."""
+        with self.lock, self.conn:
+            rows = [
+                (content_hash, start_seq + i, locator, text, " ".join(tokens))
+                for i, (locator, text, tokens) in enumerate(chunks)
+            ]
+            self.conn.executemany(
+                "INSERT INTO cached_chunks (content_hash, seq, locator, text, tokens) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute(
+                "UPDATE extraction_cache SET nbytes = nbytes + ? WHERE content_hash = ?",
+                (sum(len(r[2]) + len(r[3]) + len(r[4]) for r in rows), content_hash),
+            )
+
+    def finish_cache(self, content_hash, ok=True):
+        """Mark a claimed entry complete, or drop it if the ingest failed."""
+        with self.lock, self.conn:
+            if not ok:
+                self._drop_cached(content_hash)
+                return
+            self.conn.execute(
+                "UPDATE extraction_cache SET complete = 1, last_used = julianday('now') WHERE content_hash = ?",
+                (content_hash,),
+            )
+            self._evict()
+
+    def _drop_cached(self, content_hash):
+        self.conn.execute("DELETE FROM cached_chunks WHERE content_hash = ?", (content_hash,))
+        self.conn.execute("DELETE FROM extraction_cache WHERE content_hash = ?", (content_hash,))
+
+    def _evict(self):
+        # Caller holds the lock and an open transaction
+        total = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM extraction_cache").fetchone()[0]
+        if total <= self.cache_bytes:
+            return
+        for content_hash, nbytes in self.conn.execute(
+            "SELECT content_hash, nbytes FROM extraction_cache WHERE complete = 1 ORDER BY last_used"
+        ).fetchall():
+            self._drop_cached(content_hash)
+            total -= nbytes
+            if total <= self.cache_bytes:
+                break
+
+    def add_job(self, job, max_pending, max_per_user):
+        """Insert a queued job, or raise QueueFull if the shared queue is at capacity."""
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so the count and insert are atomic across processes
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                pending, mine = self.conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(user = ?), 0) FROM jobs WHERE state = 'queued'",
+                    (job["user"],),
+                ).fetchone()
+                if pending >= max_pending:
+                    raise QueueFull("Upload queue is full, try again shortly")
+                if mine >= max_per_user:
+                    raise QueueFull(f"{job['user']} already has {max_per_user} uploads waiting")
+                self.conn.execute(
+                    f"INSERT INTO jobs (id, {', '.join(JOB_FIELDS[1:])}, owner) VALUES ({', '.join('?' * (len(JOB_FIELDS) + 1))})",
+                    self._job_row(job) + (self.owner,),
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def update_job(self, job):
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"UPDATE jobs SET {', '.join(f + ' = ?' for f in JOB_FIELDS[1:])} WHERE id = ?",
+                self._job_row(job)[1:] + (job["job_id"],),
+            )
+
+    def load_job(self, job_id):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT id, {', '.join(JOB_FIELDS[1:])} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def count_jobs(self, state):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)).fetchone()[0]
+
+    @staticmethod
+    def _job_row(job):
+        row = dict(job, result=json.dumps(job["result"]) if job["result"] is not None else None)
+        return tuple(row[f] for f in JOB_FIELDS)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,163 @@
+import cProfile
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the last bucket is +Inf
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label(value):
+    # Prometheus label values escape backslash, double quote and newline
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= target and n:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """Per-route, per-stage latency histograms plus labelled gauges.
+
+    Rendered as Prometheus text exposition or as JSON for the benchmarks.
+    """
+
+    def __init__(self, prefix="askmynotes", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, stage, seconds):
+        with self.lock:
+            hist = self.histograms.get((route, stage))
+            if hist is None:
+                hist = self.histograms[(route, stage)] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    @contextmanager
+    def time(self, route, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(route, stage, time.perf_counter() - start)
+
+    def set_gauge(self, name, labels, value):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def replace_gauges(self, name, series):
+        """Set every series of gauge `name` from [(labels, value)]; series not listed are dropped."""
+        with self.lock:
+            self.gauges = {key: value for key, value in self.gauges.items() if key[0] != name}
+            for labels, value in series:
+                self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def as_dict(self):
+        with self.lock:
+            stages = {}
+            for (route, stage), hist in sorted(self.histograms.items()):
+                stages.setdefault(route, {})[stage] = {
+                    "count": hist.count,
+                    "sum_seconds": hist.total,
+                    "mean_seconds": hist.total / hist.count if hist.count else 0.0,
+                    "p50_seconds": hist.quantile(0.5),
+                    "p99_seconds": hist.quantile(0.99),
+                }
+            gauges = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.gauges.items())
+            ]
+        return {"stages": stages, "gauges": gauges}
+
+    def prometheus(self):
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent per request stage.", f"# TYPE {name} histogram"]
+        with self.lock:
+            for (route, stage), hist in sorted(self.histograms.items()):
+                labels = f'route="{_label(route)}",stage="{_label(stage)}"'
+                cumulative = 0
+                for bound, n in zip(self.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{labels}}} {hist.total}")
+                lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+            seen = set()
+            for (gauge, labels), value in sorted(self.gauges.items()):
+                full = f"{self.prefix}_{gauge}"
+                if full not in seen:
+                    lines.append(f"# TYPE {full} gauge")
+                    seen.add(full)
+                label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels)
+                lines.append(f"{full}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """Opt-in cProfile capture of slow requests, one request at a time.
+
+    Only one profiler can be active per process (Python 3.12+ raises if a
+    second one is enabled), so a request that starts while another is being
+    profiled just runs unprofiled. Profiles slower than the threshold are
+    written to `out_dir` as <route>-<timestamp>-<ms>ms.prof and can be
+    opened with pstats or snakeviz.
+    """
+
+    def __init__(self, threshold_ms, out_dir):
+        self.threshold = threshold_ms / 1000
+        self.out_dir = out_dir
+        self.busy = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        """Return a handle for stop(), or None when another request holds the profiler."""
+        if not self.busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some other tool (a debugger, coverage) already owns the profiling hook
+            self.busy.release()
+            return None
+        return profiler, time.perf_counter()
+
+    def stop(self, handle, route):
+        if handle is None:
+            return
+        profiler, start = handle
+        try:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                name = f"{route.strip('/').replace('/', '_') or 'root'}-{int(time.time() * 1000)}-{int(elapsed * 1000)}ms.prof"
+                profiler.dump_stats(os.path.join(self.out_dir, name))
+        finally:
+            self.busy.release()
@@ -0,0 +1,40 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """LRU cache of ranked /ask results per user/subject.
+
+    Keys carry the subject's generation number, which is bumped whenever the
+    subject receives new chunks, so stale results are never returned and
+    simply age out of the LRU order.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def generation(self, user, subject):
+        return self.generations.get((user, subject), 0)
+
+    def invalidate(self, user, subject):
+        with self.lock:
+            self.generations[(user, subject)] = self.generation(user, subject) + 1
+
+    def get(self, user, subject, key):
+        with self.lock:
+            full_key = (user, subject, self.generation(user, subject), key)
+            value = self.entries.get(full_key)
+            if value is not None:
+                self.entries.move_to_end(full_key)
+            return value
+
+    def put(self, user, subject, generation, key, value):
+        # generation is read before computing value, so results computed
+        # across an upload are filed under the old generation and never served
+        with self.lock:
+            self.entries[(user, subject, generation, key)] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
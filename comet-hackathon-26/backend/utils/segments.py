@@ -0,0 +1,493 @@
+import fcntl
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import uuid
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from itertools import chain
+
+import numpy as np
+import scipy.sparse as sp
+
+from utils.chunker import Chunk
+from utils.tfidf import idf_weights, row_norms, top_cosine
+
+MAGIC = b"AMNSEG01"
+HEADER = struct.Struct("<8sIIQ")  # magic, chunks, terms, total token count
+SECTIONS = (
+    "term_offsets",   # uint32[terms + 1] into term_blob
+    "term_blob",      # utf-8 terms, sorted by their bytes
+    "post_offsets",   # int32[terms + 1] into the postings arrays
+    "post_chunks",    # int32[postings] chunk ids
+    "post_tfs",       # int32[postings] raw term frequencies
+    "post_weights",   # float32[postings] 1 + log(tf), for tfidf mode
+    "doc_lengths",    # int32[chunks]
+    "text_offsets",   # uint64[chunks + 1] into text_blob
+    "text_blob",
+    "ref_offsets",    # uint64[chunks + 1] into ref_blob
+    "ref_blob",
+)
+SECTION_TABLE = struct.Struct("<" + "QQ" * len(SECTIONS))
+# A subject is merged in the background once it has more segments than this
+MAX_SEGMENTS = 4
+
+
+def write_segment(path, chunks):
+    """Write (text, ref, tokens) chunks as one immutable segment file; returns the chunk count."""
+    postings = {}
+    doc_lengths = array('i')
+    text_offsets, text_blob = array('Q', [0]), bytearray()
+    ref_offsets, ref_blob = array('Q', [0]), bytearray()
+    total_length = 0
+
+    for chunk_id, (text, ref, tokens) in enumerate(chunks):
+        counts = {}
+        for term in tokens:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((chunk_id, tf))
+        doc_lengths.append(len(tokens))
+        total_length += len(tokens)
+        text_blob += text.encode()
+        text_offsets.append(len(text_blob))
+        ref_blob += ref.encode()
+        ref_offsets.append(len(ref_blob))
+
+    terms = sorted(term.encode() for term in postings)
+    term_offsets, term_blob = array('I', [0]), bytearray()
+    post_offsets, post_chunks, post_tfs = array('i', [0]), array('i'), array('i')
+    for term in terms:
+        term_blob += term
+        term_offsets.append(len(term_blob))
+        for chunk_id, tf in postings[term.decode()]:
+            post_chunks.append(chunk_id)
+            post_tfs.append(tf)
+        post_offsets.append(len(post_chunks))
+    post_weights = array('f', (1.0 + math.log(tf) for tf in post_tfs))
+
+    sections = dict(
+        term_offsets=term_offsets, term_blob=term_blob, post_offsets=post_offsets,
+        post_chunks=post_chunks, post_tfs=post_tfs, post_weights=post_weights,
+        doc_lengths=doc_lengths, text_offsets=text_offsets, text_blob=text_blob,
+        ref_offsets=ref_offsets, ref_blob=ref_blob,
+    )
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(doc_lengths), len(terms), total_length))
+        f.write(b"\0" * SECTION_TABLE.size)
+        table = []
+        for name in SECTIONS:
+            # 8-byte alignment so every section can be viewed as a typed array
+            f.write(b"\0" * (-f.tell() % 8))
+            data = bytes(sections[name])
+            table += [f.tell(), len(data)]
+            f.write(data)
+        f.seek(HEADER.size)
+        f.write(SECTION_TABLE.pack(*table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(doc_lengths)
+
+
+class Segment:
+    """Read-only, memory-mapped view of a segment file.
+
+    Every worker process maps the same file, so the corpus lives once in the
+    OS page cache instead of once per worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.n_chunks, self.n_terms, self.total_length = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an index segment")
+        table = SECTION_TABLE.unpack_from(self.mm, HEADER.size)
+        self.sections = {name: (table[2 * i], table[2 * i + 1]) for i, name in enumerate(SECTIONS)}
+
+        view = memoryview(self.mm)
+        typed = {"term_offsets": "I", "post_offsets": "i", "post_chunks": "i", "post_tfs": "i",
+                 "doc_lengths": "i", "text_offsets": "Q", "ref_offsets": "Q"}
+        for name, fmt in typed.items():
+            offset, length = self.sections[name]
+            setattr(self, name, view[offset:offset + length].cast(fmt))
+        self._tfidf = None
+
+    def __len__(self):
+        return self.n_chunks
+
+    def _blob(self, name, start, stop):
+        offset = self.sections[name][0]
+        return self.mm[offset + start:offset + stop]
+
+    def _find(self, term):
+        key = term.encode()
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._blob("term_blob", self.term_offsets[mid], self.term_offsets[mid + 1])
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def lookup(self, keywords):
+        return [i for i in (self._find(term) for term in keywords) if i >= 0]
+
+    def terms(self):
+        return [self._blob("term_blob", self.term_offsets[i], self.term_offsets[i + 1]) for i in range(self.n_terms)]
+
+    def postings(self, term_id):
+        start, stop = self.post_offsets[term_id], self.post_offsets[term_id + 1]
+        return self.post_chunks[start:stop], self.post_tfs[start:stop]
+
+    def chunk(self, chunk_id):
+        text = self._blob("text_blob", self.text_offsets[chunk_id], self.text_offsets[chunk_id + 1])
+        ref = self._blob("ref_blob", self.ref_offsets[chunk_id], self.ref_offsets[chunk_id + 1])
+        return Chunk(text.decode(), ref.decode(), None)
+
+    def iter_chunks(self):
+        """Yield (text, ref, tokens) back out, for merging; tokens come back grouped by term."""
+        tokens = [[] for _ in range(self.n_chunks)]
+        for term_id, term in enumerate(self.terms()):
+            term = term.decode()
+            for chunk_id, tf in zip(*self.postings(term_id)):
+                tokens[chunk_id] += [term] * tf
+        for chunk_id in range(self.n_chunks):
+            chunk = self.chunk(chunk_id)
+            yield chunk.text, chunk.ref, tokens[chunk_id]
+
+    def tfidf(self):
+        """(chunks x terms tf matrix, document frequencies); the arrays are views into the map."""
+        if self._tfidf is None:
+            def section(name, dtype):
+                offset, length = self.sections[name]
+                return np.frombuffer(self.mm, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+            # Postings already are a CSC matrix
+            indptr = section("post_offsets", np.int32)
+            matrix = sp.csc_matrix(
+                (section("post_weights", np.float32), section("post_chunks", np.int32), indptr),
+                shape=(self.n_chunks, self.n_terms),
+            )
+            self._tfidf = (matrix, np.diff(indptr))
+        return self._tfidf
+
+
+class SegmentSet:
+    """A subject's live segments, searched as one index.
+
+    BM25 and TF-IDF statistics (chunk count, document frequencies, average
+    length) are taken over all segments, so results match a single index
+    built from the same chunks in upload order.
+    """
+
+    def __init__(self, segments, generation, k1=1.5, b=0.75):
+        self.segments = segments
+        self.generation = generation
+        self.k1 = k1
+        self.b = b
+        self.offsets = []
+        self.n_chunks = 0
+        total_length = 0
+        for segment in segments:
+            self.offsets.append(self.n_chunks)
+            self.n_chunks += segment.n_chunks
+            total_length += segment.total_length
+        self.avg_len = total_length / self.n_chunks if self.n_chunks else 1
+        self._tfidf = None
+
+    def __len__(self):
+        return self.n_chunks
+
+    def chunk(self, chunk_id):
+        i = bisect_right(self.offsets, chunk_id) - 1
+        return self.segments[i].chunk(chunk_id - self.offsets[i])
+
+    def _find(self, term):
+        # [(segment index, segment, term id)] for the segments that have the term
+        found = [(i, segment, segment._find(term)) for i, segment in enumerate(self.segments)]
+        return [(i, segment, term_id) for i, segment, term_id in found if term_id >= 0]
+
+    def search(self, keywords, top_k=3, strict=True, threshold=0.4):
+        """BM25 over the mapped postings; same scoring as InvertedIndex.search."""
+        terms = list(dict.fromkeys(keywords))
+        n = self.n_chunks
+        if not terms or not n:
+            return []
+
+        scores = {}
+        hits = {}
+        for term in terms:
+            found = self._find(term)
+            if not found:
+                continue
+            df = sum(segment.post_offsets[t + 1] - segment.post_offsets[t] for _, segment, t in found)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i, segment, term_id in found:
+                base = self.offsets[i]
+                for chunk_id, tf in zip(*segment.postings(term_id)):
+                    norm = self.k1 * (1 - self.b + self.b * segment.doc_lengths[chunk_id] / self.avg_len)
+                    key = base + chunk_id
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                    hits[key] = hits.get(key, 0) + 1
+
+        if strict:
+            min_hits = max(1, len(terms) * threshold)
+            scores = {cid: s for cid, s in scores.items() if hits[cid] >= min_hits}
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.chunk(cid), score) for cid, score in best]
+
+    def _tfidf_state(self):
+        # Per segment: (matrix, idf over the whole subject, row norms); built once per generation
+        if self._tfidf is None:
+            matrices, dfs = zip(*(segment.tfidf() for segment in self.segments)) if self.segments else ((), ())
+            if len(self.segments) > 1:
+                # Map every segment's terms onto one vocabulary to sum document frequencies
+                terms = np.array(list(chain.from_iterable(s.terms() for s in self.segments)), dtype=object)
+                _, inverse = np.unique(terms, return_inverse=True)
+                total_df = np.bincount(inverse, weights=np.concatenate(dfs))
+                splits = np.cumsum([s.n_terms for s in self.segments])[:-1]
+                dfs = [total_df[ids] for ids in np.split(inverse, splits)]
+            state = []
+            for matrix, df in zip(matrices, dfs):
+                idf = idf_weights(df, self.n_chunks)
+                state.append((matrix, idf, row_norms(matrix, idf)))
+            self._tfidf = state
+        return self._tfidf
+
+    def search_tfidf(self, keywords, top_k=3):
+        if not self.n_chunks:
+            return []
+        state = self._tfidf_state()
+
+        # The query norm is over the whole subject, so scores compare across segments
+        query_norm = 0.0
+        for term, count in Counter(keywords).items():
+            df = sum(s.post_offsets[t + 1] - s.post_offsets[t] for _, s, t in self._find(term))
+            if df:
+                query_norm += ((1.0 + math.log(count)) * idf_weights(df, self.n_chunks)) ** 2
+        if not query_norm:
+            return []
+
+        best = []
+        for i, (segment, (matrix, idf, norms)) in enumerate(zip(self.segments, state)):
+            for row, score in top_cosine(matrix, idf, norms, segment.lookup(keywords), top_k, math.sqrt(query_norm)):
+                best.append((self.offsets[i] + row, score))
+        best = heapq.nlargest(top_k, best, key=lambda item: item[1])
+        return [(self.chunk(cid), score) for cid, score in best]
+
+
+def _safe(name):
+    return re.sub(r'[^a-z0-9_.-]', '_', name.lower())
+
+
+class SegmentCatalog:
+    """Publishes and opens each user/subject's segments under `root`.
+
+    Layout: root/<user>/<subject>/ holds immutable *.seg files and a
+    MANIFEST (JSON) listing the live ones in upload order, with the
+    documents each covers. A finished upload is written as its own small
+    segment and appended to the manifest, so publishing costs the size of
+    that document, not of the subject. Once there are more than
+    `max_segments`, `merge` folds them together off the request path.
+
+    The manifest is replaced with an atomic rename and carries a generation
+    number. Readers stat it on each lookup and map the new segments when it
+    changes, so workers pick up uploads without a restart. Files dropped by
+    a merge are deleted one merge later, once no reader can still be
+    opening them.
+    """
+
+    def __init__(self, root, max_segments=MAX_SEGMENTS):
+        self.root = root
+        self.max_segments = max_segments
+        self.sets = {}
+        self.files = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, user, subject):
+        return os.path.join(self.root, _safe(user), _safe(subject))
+
+    @contextmanager
+    def _locked(self, directory, name="LOCK", blocking=True):
+        # flock serialises writers across worker processes; yields False if busy and not blocking
+        with open(os.path.join(directory, name), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def _read_manifest(self, directory):
+        try:
+            with open(os.path.join(directory, "MANIFEST")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, directory, manifest, retire=None):
+        """Make `manifest` live as the next generation; returns the generation."""
+        previous = manifest.get("retired", [])
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        if retire is not None:
+            manifest["retired"] = retire
+        path = os.path.join(directory, "MANIFEST")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        if retire is not None:
+            for name in previous:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        return manifest["generation"]
+
+    def _open(self, path):
+        segment = self.files.get(path)
+        if segment is None:
+            segment = self.files[path] = Segment(path)
+        return segment
+
+    def get(self, user, subject):
+        """The subject's live SegmentSet, or None if it has never been published."""
+        directory = self._dir(user, subject)
+        path = os.path.join(directory, "MANIFEST")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+
+        cached = self.sets.get((user, subject))
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        for _ in range(3):
+            manifest = self._read_manifest(directory)
+            try:
+                segments = [self._open(os.path.join(directory, e["file"])) for e in manifest["segments"]]
+                break
+            except FileNotFoundError:
+                # A merge replaced the manifest between reading it and opening its files
+                continue
+        else:
+            return cached[1] if cached else None
+
+        segment_set = SegmentSet(segments, manifest["generation"])
+        self.sets[(user, subject)] = (stamp, segment_set)
+        live = {s.path for _, current in self.sets.values() for s in current.segments}
+        self.files = {p: s for p, s in self.files.items() if p in live}
+        return segment_set
+
+    def append(self, user, subject, document_id, chunks):
+        """Publish one document as a new segment; returns the generation.
+
+        Returns None without publishing if the subject has no manifest yet,
+        since the new segment alone would hide its earlier documents; the
+        caller should `rebuild` it instead.
+        """
+        directory = self._dir(user, subject)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{uuid.uuid4().hex}.seg"
+        path = os.path.join(directory, name)
+        n_chunks = write_segment(path, chunks)
+
+        with self._locked(directory):
+            manifest = self._read_manifest(directory)
+            if manifest is None or not n_chunks or any(document_id in e["documents"] for e in manifest["segments"]):
+                # Nothing to add, or a rebuild already included this document
+                os.remove(path)
+                return manifest["generation"] if manifest else None
+            manifest["segments"].append({"file": name, "documents": [document_id], "chunks": n_chunks})
+            return self._write_manifest(directory, manifest)
+
+    def rebuild(self, user, subject, documents):
+        """Replace the subject with one segment built from `documents()`, [(document_id, chunks)].
+
+        `documents` is called with the publish lock held, so a document
+        finishing meanwhile is either in the rebuild or appended after it.
+        Nothing is written if the live segments already cover every document.
+        """
+        directory = self._dir(user, subject)
+        os.makedirs(directory, exist_ok=True)
+        with self._locked(directory):
+            docs = documents()
+            manifest = self._read_manifest(directory)
+            if manifest is not None and {d for e in manifest["segments"] for d in e["documents"]}.issuperset(
+                d for d, _ in docs
+            ):
+                # Another process rebuilt the subject while this one waited for the lock
+                return manifest["generation"]
+            name = f"{uuid.uuid4().hex}.seg"
+            n_chunks = write_segment(os.path.join(directory, name), chain.from_iterable(c for _, c in docs))
+            manifest = manifest or {"generation": 0, "segments": []}
+            retire = [e["file"] for e in manifest["segments"]]
+            manifest["segments"] = [{"file": name, "documents": [d for d, _ in docs], "chunks": n_chunks}]
+            generation = self._write_manifest(directory, manifest, retire=retire)
+            # Files from the single-file layout (CURRENT naming one gen-N.seg)
+            for old in os.listdir(directory):
+                if old == "CURRENT" or old.startswith("gen-"):
+                    os.remove(os.path.join(directory, old))
+            return generation
+
+    def needs_merge(self, user, subject):
+        manifest = self._read_manifest(self._dir(user, subject))
+        return manifest is not None and self._pick_merge(manifest["segments"]) is not None
+
+    def _pick_merge(self, entries):
+        if len(entries) <= self.max_segments:
+            return None
+        # Fold the newer segments together while they are smaller than the oldest,
+        # so a large subject is only rewritten once it has about doubled
+        if sum(e["chunks"] for e in entries[1:]) < entries[0]["chunks"]:
+            return 1, len(entries)
+        return 0, len(entries)
+
+    def merge(self, user, subject):
+        """Merge the segments picked by the merge policy into one; no-op if another merge is running."""
+        directory = self._dir(user, subject)
+        with self._locked(directory, "MERGE", blocking=False) as acquired:
+            if not acquired:
+                return None
+            manifest = self._read_manifest(directory)
+            picked = self._pick_merge(manifest["segments"]) if manifest else None
+            if picked is None:
+                return None
+            lo, hi = picked
+            entries = manifest["segments"][lo:hi]
+
+            # Written without the publish lock, so uploads keep appending meanwhile
+            name = f"{uuid.uuid4().hex}.seg"
+            path = os.path.join(directory, name)
+            sources = [Segment(os.path.join(directory, e["file"])) for e in entries]
+            n_chunks = write_segment(path, chain.from_iterable(s.iter_chunks() for s in sources))
+
+            with self._locked(directory):
+                current = self._read_manifest(directory)
+                if [e["file"] for e in current["segments"][lo:hi]] != [e["file"] for e in entries]:
+                    # A rebuild replaced these segments while we were merging
+                    os.remove(path)
+                    return None
+                merged = {"file": name, "documents": [d for e in entries for d in e["documents"]], "chunks": n_chunks}
+                current["segments"][lo:hi] = [merged]
+                return self._write_manifest(directory, current, retire=[e["file"] for e in entries])
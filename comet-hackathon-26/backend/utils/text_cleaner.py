@@ -1,18 +1,59 @@
 import re
-import nltk
-from nltk.corpus import stopwords
+from functools import lru_cache
 
-nltk.download('stopwords')
+# NLTK's English stopword list, used when the corpus isn't installed locally.
+# Startup never downloads anything.
+FALLBACK_STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours
+yourself yourselves he him his himself she she's her hers herself it it's its
+itself they them their theirs themselves what which who whom this that that'll
+these those am is are was were be been being have has had having do does did
+doing a an the and but if or because as until while of at by for with about
+against between into through during before after above below to from up down
+in out on off over under again further then once here there when where why how
+all any both each few more most other some such no nor not only own same so
+than too very s t can will just don don't should should've now d ll m o re ve
+y ain aren aren't couldn couldn't didn didn't doesn doesn't hadn hadn't hasn
+hasn't haven haven't isn isn't ma mightn mightn't mustn mustn't needn needn't
+shan shan't shouldn shouldn't wasn wasn't weren weren't won won't wouldn
+wouldn't
+""".split())
+
+
+def load_stop_words():
+    try:
+        from nltk.corpus import stopwords
+        return frozenset(stopwords.words("english"))
+    except (ImportError, LookupError):
+        return FALLBACK_STOP_WORDS
+
+
+STOP_WORDS = load_stop_words()
+NON_ALNUM = re.compile(r'[^a-zA-Z0-9\s]')
+# Questions up to this length go through the memoized fast path
+SHORT_TEXT = 200
 
-STOP_WORDS = set(stopwords.words("english"))
 
 def clean_text(text):
     text = text.lower()
-    text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
+    text = NON_ALNUM.sub('', text)
     return text
 
-def extract_keywords(question):
-    question = clean_text(question)
-    words = question.split()
+
+# Not cached: the chunker runs every document chunk through here
+def extract_keywords(text):
+    words = clean_text(text).split()
     keywords = [w for w in words if w not in STOP_WORDS and len(w) > 2]
-    return keywords
\ No newline at end of file
+    return keywords
+
+
+@lru_cache(maxsize=4096)
+def _short_question_keywords(question):
+    return tuple(extract_keywords(question))
+
+
+# Questions only, so ingest can't evict what a class keeps asking
+def question_keywords(question):
+    if len(question) <= SHORT_TEXT:
+        return list(_short_question_keywords(question))
+    return extract_keywords(question)
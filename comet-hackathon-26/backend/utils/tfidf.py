@@ -0,0 +1,115 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class TfidfMatrix:
+    """Sparse TF-IDF matrix over a subject's chunks, updated incrementally.
+
+    Rows hold sublinear term frequencies (1 + log tf) and are only ever
+    appended; document frequencies are kept as running counts. IDF weights
+    are applied at query time, so new uploads never refit earlier rows and
+    a query costs two sparse matrix-vector products over the whole subject.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.matrix = None
+        self.df = np.zeros(0, dtype=np.int64)
+        self.n_rows = 0
+        self.idf = None
+        self.norms = None
+
+    def partial_fit(self, rows, n_terms):
+        """Append rows, each an array of vocabulary term ids."""
+        if len(self.df) < n_terms:
+            self.df = np.concatenate([self.df, np.zeros(n_terms - len(self.df), dtype=np.int64)])
+        if not rows:
+            return
+
+        indptr = [0]
+        indices = []
+        data = []
+        for terms in rows:
+            ids, counts = np.unique(np.frombuffer(terms, dtype=np.uint32), return_counts=True)
+            indices.append(ids)
+            data.append(1.0 + np.log(counts))
+            indptr.append(indptr[-1] + len(ids))
+            self.df[ids] += 1
+
+        block = sp.csr_matrix(
+            (np.concatenate(data), np.concatenate(indices), indptr),
+            shape=(len(rows), n_terms),
+        )
+        self.blocks.append(block)
+        self.n_rows += len(rows)
+        self.norms = None
+
+    def _compact(self):
+        n_terms = len(self.df)
+        if self.matrix is not None:
+            self.blocks.insert(0, self.matrix)
+        # New matrices over the same arrays; a snapshot being scored is never resized
+        blocks = [sp.csr_matrix((b.data, b.indices, b.indptr), shape=(b.shape[0], n_terms)) for b in self.blocks]
+        self.matrix = sp.vstack(blocks, format='csr') if len(blocks) > 1 else blocks[0]
+        self.blocks = []
+
+    def snapshot(self):
+        """Fold pending blocks in; return (matrix, idf, norms), or None while empty.
+
+        The returned arrays are never modified afterwards, so they can be
+        scored without a lock while later rows are appended.
+        """
+        if self.blocks:
+            self._compact()
+        if self.matrix is None:
+            return None
+        if self.norms is None:
+            self.idf = idf_weights(self.df[:self.matrix.shape[1]], self.n_rows)
+            self.norms = row_norms(self.matrix, self.idf)
+        return self.matrix, self.idf, self.norms
+
+    def search(self, term_ids, top_k=3):
+        """Return [(row, cosine score)] for the best rows, highest first."""
+        snapshot = self.snapshot()
+        if snapshot is None or not term_ids:
+            return []
+        return search_snapshot(snapshot, term_ids, top_k)
+
+
+def idf_weights(df, n_rows):
+    return np.log((1 + n_rows) / (1 + df)) + 1.0
+
+
+def row_norms(matrix, idf):
+    """L2 norm of each row once IDF weights are applied (1 for empty rows)."""
+    norms = np.sqrt(matrix.power(2) @ (idf ** 2))
+    norms[norms == 0] = 1.0
+    return norms
+
+
+def search_snapshot(snapshot, term_ids, top_k):
+    matrix, idf, norms = snapshot
+    # Terms newer than the snapshot have no rows in it yet
+    return top_cosine(matrix, idf, norms, [t for t in term_ids if t < len(idf)], top_k)
+
+
+def top_cosine(matrix, idf, norms, term_ids, top_k, query_norm=None):
+    """Cosine similarity of a keyword query against every row of a tf matrix.
+
+    `query_norm` overrides the norm of the query vector, for scoring one
+    part of a larger index against the query as seen by the whole index.
+    """
+    query = np.zeros(len(idf))
+    np.add.at(query, term_ids, 1.0)
+    query[query > 0] = 1.0 + np.log(query[query > 0])
+    query *= idf
+    if query_norm is None:
+        query_norm = np.linalg.norm(query)
+    if not query_norm:
+        return []
+
+    scores = (matrix @ (query * idf)) / (norms * query_norm)
+    k = min(top_k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(row), float(scores[row])) for row in best if scores[row] > 0]
@@ -91,8 +91,20 @@ const App = () => {
     try {
       const res = await fetch('http://127.0.0.1:5000/upload', { method: 'POST', body: formData });
       if (res.ok) {
-        setSources([...sources, { id: Date.now(), name: file.name, tab: activeTab }]);
-        setMessages(prev => [...prev, { role: 'ai', text: `✅ indexed: ${file.name}` }]);
+        // Indexing runs in the background; poll the job until it finishes.
+        // Files the server has already seen come back without a job.
+        const { job_id } = await res.json();
+        let job = { state: job_id ? 'queued' : 'done' };
+        while (job.state === 'queued' || job.state === 'running') {
+          await new Promise(r => setTimeout(r, 1000));
+          job = await (await fetch(`http://127.0.0.1:5000/upload/${job_id}`)).json();
+        }
+        if (job.state === 'done') {
+          setSources(prev => [...prev, { id: Date.now(), name: file.name, tab: activeTab }]);
+          setMessages(prev => [...prev, { role: 'ai', text: `✅ indexed: ${file.name}` }]);
+        } else {
+          setMessages(prev => [...prev, { role: 'ai', text: `⚠️ could not index ${file.name}: ${job.error || job.message}` }]);
+        }
       }
     } finally { setLoading(false); }
   };